@@ -5,9 +5,19 @@ This script should be run from the dataset root directory.
 """
 
 import os
-import glob
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+def delete_file(file_path):
+    """Delete a file, returning True on success"""
+    try:
+        os.remove(file_path)
+        print(f"Deleted: {file_path}")
+        return True
+    except Exception as e:
+        print(f"Error deleting {file_path}: {e}")
+        return False
+
 def clean_json_files():
     """Delete all previously generated JSON files"""
     
@@ -32,16 +42,11 @@ def clean_json_files():
         folder_path = root_dir / folder
         if folder_path.exists():
             # Find all JSON files in the folder
-            json_pattern = str(folder_path / "*.json")
-            json_files = glob.glob(json_pattern)
+            with os.scandir(folder_path) as entries:
+                json_files = [entry.path for entry in entries if entry.name.endswith('.json')]
             
-            for json_file in json_files:
-                try:
-                    os.remove(json_file)
-                    print(f"Deleted: {json_file}")
-                    total_deleted += 1
-                except Exception as e:
-                    print(f"Error deleting {json_file}: {e}")
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                total_deleted += sum(executor.map(delete_file, json_files))
         else:
             print(f"Folder {folder_path} does not exist")
     
@@ -7,43 +7,142 @@ import os
 import json
 import csv
 import argparse
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from PIL import Image
-import random
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from turbojpeg import TurboJPEG
+    turbojpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    turbojpeg = None
+
+# Enough leading bytes to reach the SOF marker past a full EXIF segment
+JPEG_HEADER_BYTES = 1 << 17
+
+def load_json(json_path):
+    """Load a JSON file, using orjson when available"""
+    with open(json_path, 'rb') as f:
+        content = f.read()
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def save_json(data, json_path):
+    """Save data as indented JSON in a single write, using orjson when available"""
+    if orjson is not None:
+        content = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    else:
+        content = json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+    Path(json_path).write_bytes(content)
+
+def dumps_json(data):
+    """Serialize data to compact JSON bytes, using orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def save_coco_json_streaming(coco_data, json_path):
+    """Save a COCO dict one image/annotation record at a time"""
+    with open(json_path, 'wb') as f:
+        f.write(b'{"info":')
+        f.write(dumps_json(coco_data['info']))
+        for key in ('images', 'annotations'):
+            f.write(b',"' + key.encode('utf-8') + b'":[')
+            for i, record in enumerate(coco_data[key]):
+                if i:
+                    f.write(b',')
+                f.write(dumps_json(record))
+            f.write(b']')
+        f.write(b',"categories":')
+        f.write(dumps_json(coco_data['categories']))
+        f.write(b',"licenses":')
+        f.write(dumps_json(coco_data['licenses']))
+        f.write(b'}\n')
+
+@functools.lru_cache(maxsize=None)
+def load_labelmap_items(labelmap_path):
+    """Load labelmap.json as (object_id, object_name) pairs sorted by object_id"""
+    return tuple(sorted(load_labelmap(labelmap_path).items()))
 
 def load_labelmap(labelmap_path):
     """Load labelmap.json"""
-    with open(labelmap_path, 'r', encoding='utf-8') as f:
-        labelmap = json.load(f)
+    labelmap = load_json(labelmap_path)
     return {item['object_id']: item['object_name'] for item in labelmap}
 
 def parse_csv(csv_path):
     """Parse CSV annotation file"""
     annotations = []
-    with open(csv_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return annotations
+        
+        # Resolve column positions once, accepting alternative column names
+        columns = {name: idx for idx, name in enumerate(header)}
+        def find_column(*names):
+            return next((columns[name] for name in names if name in columns), None)
+        item_col = find_column('#item')
+        x_col = find_column('x')
+        y_col = find_column('y')
+        width_col = find_column('width', 'w', 'dx')
+        height_col = find_column('height', 'h', 'dy')
+        label_col = find_column('label', 'class', 'category_id')
+        
         for row in reader:
-            # Skip comment lines
-            if row.get('#item', '').startswith('#'):
+            if not row:
                 continue
             try:
-                item = int(row.get('#item', 0))
-                x = float(row.get('x', 0))
-                y = float(row.get('y', 0))
-                width = float(row.get('width', row.get('w', row.get('dx', 0))))
-                height = float(row.get('height', row.get('h', row.get('dy', 0))))
-                label = int(row.get('label', row.get('class', row.get('category_id', 1))))
+                # Skip comment lines
+                if item_col is not None and row[item_col].startswith('#'):
+                    continue
+                item = int(row[item_col]) if item_col is not None else 0
+                x = float(row[x_col]) if x_col is not None else 0.0
+                y = float(row[y_col]) if y_col is not None else 0.0
+                width = float(row[width_col]) if width_col is not None else 0.0
+                height = float(row[height_col]) if height_col is not None else 0.0
+                label = int(row[label_col]) if label_col is not None else 1
                 annotations.append({
                     'item': item,
                     'bbox': [x, y, width, height],
                     'label': label
                 })
-            except (ValueError, KeyError) as e:
+            except (ValueError, IndexError):
                 continue
     return annotations
 
+# Image file extensions, in order of preference
+IMAGE_EXTENSIONS = ['.jpg', '.JPG', '.png', '.PNG', '.jpeg', '.JPEG', '.bmp', '.BMP']
+
+def index_images(images_dir):
+    """Map image stems to paths with a single scan of the images directory"""
+    images = {}
+    with os.scandir(images_dir) as entries:
+        for entry in entries:
+            stem, ext = os.path.splitext(entry.name)
+            if ext in IMAGE_EXTENSIONS and entry.is_file():
+                images.setdefault(stem, []).append((IMAGE_EXTENSIONS.index(ext), entry.name))
+    
+    # Keep the preferred extension for each stem
+    return {stem: images_dir / min(candidates)[1] for stem, candidates in images.items()}
+
 def get_image_info(image_path):
     """Get image dimensions"""
+    if turbojpeg is not None and str(image_path).lower().endswith(('.jpg', '.jpeg')):
+        try:
+            with open(image_path, 'rb') as f:
+                width, height, _, _ = turbojpeg.decode_header(f.read(JPEG_HEADER_BYTES))
+            return (width, height)
+        except Exception:
+            pass  # Fall back to PIL
     try:
         with Image.open(image_path) as img:
             return img.size
@@ -70,8 +169,7 @@ def convert_to_coco(root_dir, output_dir, categories=None, splits=None, combined
         category_dir = root / category
         labelmap_path = category_dir / 'labelmap.json'
         if labelmap_path.exists():
-            labelmap = load_labelmap(labelmap_path)
-            for obj_id, obj_name in sorted(labelmap.items()):
+            for obj_id, obj_name in load_labelmap_items(str(labelmap_path)):
                 if obj_id == 0:
                     continue
                 combined_categories.append({
@@ -82,9 +180,16 @@ def convert_to_coco(root_dir, output_dir, categories=None, splits=None, combined
                 category_name_map[category] = obj_name
                 cat_id += 1
     
+    # Map category names to IDs in combined file
+    combined_cat_map = {cat['name']: cat['id'] for cat in combined_categories}
+    
     # Process each category
     all_coco_data = {}
     
+    # Image and annotation IDs are unique per split so they do not collide in combined files
+    image_id_counters = {split: itertools.count(1) for split in splits}
+    annotation_id_counters = {split: itertools.count(1) for split in splits}
+    
     for category in categories:
         category_dir = root / category
         images_dir = category_dir / 'images'
@@ -101,11 +206,12 @@ def convert_to_coco(root_dir, output_dir, categories=None, splits=None, combined
             print(f"Warning: {labelmap_path} does not exist, skipping {category}")
             continue
         
-        labelmap = load_labelmap(labelmap_path)
+        labelmap_items = load_labelmap_items(str(labelmap_path))
+        image_index = index_images(images_dir)
         
         # Build category list from labelmap (only non-background categories)
         coco_categories = []
-        for obj_id, obj_name in sorted(labelmap.items()):
+        for obj_id, obj_name in labelmap_items:
             if obj_id == 0:
                 continue  # Skip background
             coco_categories.append({
@@ -114,6 +220,10 @@ def convert_to_coco(root_dir, output_dir, categories=None, splits=None, combined
                 'supercategory': 'flower'
             })
         
+        # Get the combined category ID for this category folder
+        category_name = category_name_map.get(category, 'flower')
+        combined_category_id = combined_cat_map.get(category_name, 1)
+        
         # Process each split
         for split in splits:
             coco_data = {
@@ -140,14 +250,24 @@ def convert_to_coco(root_dir, output_dir, categories=None, splits=None, combined
                 print(f"Warning: Split file '{split_file}' does not exist, skipping {category}/{split}")
                 continue
             
+            # Add to combined data
+            if split not in all_coco_data:
+                all_coco_data[split] = {
+                    'info': {
+                        'year': 2025,
+                        'version': '1.0',
+                        'description': f'Peach-Pear Flower Segmentation combined {split} split',
+                        'url': 'https://agdatacommons.nal.usda.gov/download/articles/24852636/versions/1/'
+                    },
+                    'images': [],
+                    'annotations': [],
+                    'categories': combined_categories,
+                    'licenses': []
+                }
+            combined_data = all_coco_data[split]
+            
             # Get images in this split
-            image_files = []
-            for stem in split_images:
-                for ext in ['.jpg', '.JPG', '.png', '.PNG', '.jpeg', '.JPEG', '.bmp', '.BMP']:
-                    img_path = images_dir / f"{stem}{ext}"
-                    if img_path.exists():
-                        image_files.append(img_path)
-                        break
+            image_files = [image_index[stem] for stem in split_images if stem in image_index]
             
             print(f"  Found {len(image_files)}/{len(split_images)} images for {category}/{split}")
             
@@ -155,90 +275,62 @@ def convert_to_coco(root_dir, output_dir, categories=None, splits=None, combined
             image_id_map = {}
             annotation_id = 1
             
-            for img_path in image_files:
+            # Read image headers in parallel (I/O bound)
+            with ThreadPoolExecutor(max_workers=32) as executor:
+                image_sizes = list(executor.map(get_image_info, image_files))
+            
+            for img_path, (width, height) in zip(image_files, image_sizes):
                 stem = img_path.stem
                 
-                # Get image info
-                width, height = get_image_info(img_path)
-                image_id = random.randint(1000000000, 9999999999)
+                image_id = next(image_id_counters[split])
                 image_id_map[stem] = image_id
                 
-                coco_data['images'].append({
+                image_info = {
                     'id': image_id,
                     'file_name': f'{category}/images/{img_path.name}',
                     'width': width,
                     'height': height
-                })
+                }
+                coco_data['images'].append(image_info)
+                combined_data['images'].append(image_info)
                 
                 # Load CSV annotations
                 csv_path = csv_dir / f'{stem}.csv'
                 if csv_path.exists():
                     annotations = parse_csv(csv_path)
-                    for ann in annotations:
-                        bbox = ann['bbox']
-                        label = ann['label']
-                        
-                        # Map label to category_id (use 1 for single category per folder)
-                        category_id = 1  # Each category folder has only one non-background category
-                        
-                        coco_data['annotations'].append({
-                            'id': annotation_id,
-                            'image_id': image_id,
-                            'category_id': category_id,
-                            'bbox': bbox,
-                            'area': bbox[2] * bbox[3],
-                            'iscrowd': 0
-                        })
-                        annotation_id += 1
+                    
+                    # Map label to category_id (use 1 for single category per folder)
+                    coco_data['annotations'].extend([{
+                        'id': annotation_id + i,
+                        'image_id': image_id,
+                        'category_id': 1,  # Each category folder has only one non-background category
+                        'bbox': ann['bbox'],
+                        'area': ann['bbox'][2] * ann['bbox'][3],
+                        'iscrowd': 0
+                    } for i, ann in enumerate(annotations)])
+                    combined_data['annotations'].extend([{
+                        'id': next(annotation_id_counters[split]),
+                        'image_id': image_id,
+                        'category_id': combined_category_id,
+                        'bbox': ann['bbox'],
+                        'area': ann['bbox'][2] * ann['bbox'][3],
+                        'iscrowd': 0
+                    } for ann in annotations])
+                    annotation_id += len(annotations)
             
             # Save single category file
             if len(coco_data['images']) > 0:
                 output_file = output / f'{category}_instances_{split}.json'
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    json.dump(coco_data, f, indent=2, ensure_ascii=False)
+                save_json(coco_data, output_file)
                 print(f"Created {output_file}: {len(coco_data['images'])} images, {len(coco_data['annotations'])} annotations")
-            
-            # Add to combined data
-            if split not in all_coco_data:
-                all_coco_data[split] = {
-                    'info': {
-                        'year': 2025,
-                        'version': '1.0',
-                        'description': f'Peach-Pear Flower Segmentation combined {split} split',
-                        'url': 'https://agdatacommons.nal.usda.gov/download/articles/24852636/versions/1/'
-                    },
-                    'images': [],
-                    'annotations': [],
-                    'categories': combined_categories,
-                    'licenses': []
-                }
-            
-            # Map category names to IDs in combined file
-            combined_cat_map = {}
-            for cat in combined_categories:
-                combined_cat_map[cat['name']] = cat['id']
-            
-            # Get the category name for this category folder
-            category_name = category_name_map.get(category, 'flower')
-            combined_category_id = combined_cat_map.get(category_name, 1)
-            
-            # Add images and annotations to combined data
-            for img in coco_data['images']:
-                all_coco_data[split]['images'].append(img)
-            
-            # Remap category IDs for combined file
-            for ann in coco_data['annotations']:
-                new_ann = ann.copy()
-                new_ann['category_id'] = combined_category_id
-                all_coco_data[split]['annotations'].append(new_ann)
     
     # Create combined files if requested
     if combined:
         for split in splits:
             if split in all_coco_data and len(all_coco_data[split]['images']) > 0:
                 output_file = output / f'combined_instances_{split}.json'
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    json.dump(all_coco_data[split], f, indent=2, ensure_ascii=False)
+                # Combined files can be large, so keep streaming them record by record
+                save_coco_json_streaming(all_coco_data[split], output_file)
                 print(f"Created {output_file}: {len(all_coco_data[split]['images'])} images, {len(all_coco_data[split]['annotations'])} annotations")
 
 def main():
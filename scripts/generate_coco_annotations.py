@@ -7,17 +7,30 @@ This script should be run from the dataset root directory.
 
 import os
 import json
-import random
-import time
+import functools
+import multiprocessing
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def save_json(data, json_path):
+    """Save data as compact JSON in a single write, using orjson when available"""
+    if orjson is not None:
+        content = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    else:
+        content = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    Path(json_path).write_bytes(content)
+
 def generate_unique_id():
-    """Generate unique ID: 7 random digits + 3 digit timestamp"""
-    random_part = random.randint(1000000, 9999999)
-    timestamp_part = int(time.time()) % 1000
-    return int(f"{random_part}{timestamp_part:03d}")
+    """Generate random 32-bit ID from a UUID4"""
+    return uuid.uuid4().int >> 96
 
 def get_image_info(image_path, image_id):
     """Generate image information for COCO format"""
@@ -36,20 +49,18 @@ def get_image_info(image_path, image_id):
         "status": "success"
     }
 
+@functools.lru_cache(maxsize=None)
 def find_white_bbox(label_image_path):
-    """Find minimum bounding box of white regions in the label image"""
+    """Find bounding box (x, y, w, h) of the largest white region in the label image"""
     try:
-        # Read image
-        img = cv2.imread(str(label_image_path))
-        if img is None:
+        # Read label mask directly as grayscale
+        gray = cv2.imread(str(label_image_path), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
             print(f"Could not read label image: {label_image_path}")
-            return [0, 0, 512, 512]
+            return (0, 0, 512, 512)
         
         # Get image dimensions
-        height, width = img.shape[:2]
-        
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        height, width = gray.shape
         
         # Threshold to find white regions (assuming white is close to 255)
         _, thresh = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY)
@@ -59,7 +70,7 @@ def find_white_bbox(label_image_path):
         
         if not contours:
             print(f"No white regions found in {os.path.basename(label_image_path)}")
-            return [0, 0, width, height]
+            return (0, 0, width, height)
         
         # Find the largest contour (assumed to be the main white region)
         largest_contour = max(contours, key=cv2.contourArea)
@@ -73,11 +84,11 @@ def find_white_bbox(label_image_path):
         w = min(w, width - x)
         h = min(h, height - y)
         
-        return [x, y, w, h]
+        return (x, y, w, h)
         
     except Exception as e:
         print(f"Error processing label image {label_image_path}: {e}")
-        return [0, 0, 512, 512]
+        return (0, 0, 512, 512)
 
 def get_annotation_info(image_id, category_id, bbox):
     """Generate annotation information for COCO format"""
@@ -102,40 +113,51 @@ def get_category_info(category_name):
         "supercategory": "Flower Image"
     }
 
+# Possible label image extensions, in order of preference
+LABEL_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.bmp']
+
+@functools.lru_cache(maxsize=None)
+def _index_label_folder(label_folder):
+    """Map label image stems to paths with a single scan of the label folder"""
+    index = {}
+    try:
+        with os.scandir(label_folder) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext in LABEL_EXTENSIONS and entry.is_file():
+                    index.setdefault(stem, []).append((LABEL_EXTENSIONS.index(ext), entry.path))
+    except FileNotFoundError:
+        return {}
+    
+    # Keep the preferred extension for each stem
+    return {stem: min(candidates)[1] for stem, candidates in index.items()}
+
 def find_corresponding_label_image(image_path, label_folders):
     """Find the corresponding label image for a given image in multiple label folders"""
     image_name = os.path.splitext(os.path.basename(image_path))[0]
     
-    # Try different possible label image names
-    possible_extensions = ['.png', '.jpg', '.jpeg', '.bmp']
+    # Try the full name, then just the number part (for IMG_XXXX.JPG -> XXXX.png),
+    # then the number part without leading zeros
+    name_variants = [image_name]
+    if image_name.startswith('IMG_'):
+        number_part = image_name[4:]  # Remove 'IMG_' prefix
+        name_variants.append(number_part)
+        if number_part.isdigit():
+            name_variants.append(str(int(number_part)))
     
     for label_folder in label_folders:
-        if not os.path.exists(label_folder):
-            continue
-            
-        for ext in possible_extensions:
-            label_image_path = os.path.join(label_folder, f"{image_name}{ext}")
-            if os.path.exists(label_image_path):
-                return label_image_path
-        
-        # If not found, try with just the number part (for IMG_XXXX.JPG -> XXXX.png)
-        if image_name.startswith('IMG_'):
-            number_part = image_name[4:]  # Remove 'IMG_' prefix
-            for ext in possible_extensions:
-                label_image_path = os.path.join(label_folder, f"{number_part}{ext}")
-                if os.path.exists(label_image_path):
-                    return label_image_path
-                
-                # Try removing leading zeros
-                number_part_no_zeros = str(int(number_part))
-                label_image_path = os.path.join(label_folder, f"{number_part_no_zeros}{ext}")
-                if os.path.exists(label_image_path):
-                    return label_image_path
+        label_index = _index_label_folder(label_folder)
+        for name in name_variants:
+            if name in label_index:
+                return label_index[name]
     
     return None
 
-def create_single_image_coco_json(image_path, category_name, label_folders):
-    """Create COCO format JSON for a single image with bbox from label image"""
+def create_single_image_coco_json(image_path, category_name, label_folders, bbox=None):
+    """Create COCO format JSON for a single image with bbox from label image
+    
+    If bbox is not given, it is computed from the image's label image.
+    """
     
     # Generate category info
     category_info = get_category_info(category_name)
@@ -146,14 +168,15 @@ def create_single_image_coco_json(image_path, category_name, label_folders):
     image_info = get_image_info(str(image_path), image_id)
     
     # Find corresponding label image and get bbox
-    label_image_path = find_corresponding_label_image(image_path, label_folders)
-    if label_image_path:
-        bbox = find_white_bbox(label_image_path)
-    else:
-        bbox = [0, 0, 512, 512]
+    if bbox is None:
+        label_image_path = find_corresponding_label_image(image_path, label_folders)
+        if label_image_path:
+            bbox = find_white_bbox(label_image_path)
+        else:
+            bbox = (0, 0, 512, 512)
     
     # Generate annotation info
-    annotation_info = get_annotation_info(image_id, category_id, bbox)
+    annotation_info = get_annotation_info(image_id, category_id, list(bbox))
     
     # Create COCO format JSON
     coco_data = {
@@ -179,21 +202,23 @@ def create_single_image_coco_json(image_path, category_name, label_folders):
     json_filename = f"{image_name}.json"
     json_path = os.path.join(image_dir, json_filename)
     
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(coco_data, f, indent=2, ensure_ascii=False)
+    save_json(coco_data, json_path)
     
     print(f"Generated {json_path}")
 
+def _create_single_image_coco_json_task(args):
+    """Unpack a (image_path, category_name, label_folders, bbox) tuple for Pool workers"""
+    create_single_image_coco_json(*args)
+
 def process_image_folder(folder_path, category_name, label_folders):
     """Process all images in a folder and create individual JSON files"""
     
     # Get all image files
-    image_extensions = ['.jpg', '.jpeg', '.bmp', '.png']
-    image_files = []
-    
-    for ext in image_extensions:
-        image_files.extend(Path(folder_path).glob(f"*{ext}"))
-        image_files.extend(Path(folder_path).glob(f"*{ext.upper()}"))
+    image_extensions = frozenset(['.jpg', '.jpeg', '.bmp', '.png'])
+    with os.scandir(folder_path) as entries:
+        image_files = [entry.path for entry in entries
+                       if os.path.splitext(entry.name)[1].lower() in image_extensions
+                       and entry.is_file()]
     
     if not image_files:
         print(f"No image files found in {folder_path}")
@@ -202,8 +227,20 @@ def process_image_folder(folder_path, category_name, label_folders):
     print(f"Processing {len(image_files)} images in {folder_path}...")
     print(f"Using label folders: {label_folders}")
     
-    for image_path in image_files:
-        create_single_image_coco_json(str(image_path), category_name, label_folders)
+    # Decode each label image once, in parallel threads, and hand the bboxes to the
+    # pool workers so they never decode label images themselves
+    image_labels = {image_path: find_corresponding_label_image(image_path, label_folders)
+                    for image_path in image_files}
+    label_image_paths = list({path for path in image_labels.values() if path is not None})
+    with ThreadPoolExecutor() as executor:
+        label_bboxes = dict(zip(label_image_paths, executor.map(find_white_bbox, label_image_paths)))
+    
+    tasks = [(image_path, category_name, label_folders,
+              label_bboxes.get(image_labels[image_path], (0, 0, 512, 512)))
+             for image_path in image_files]
+    with multiprocessing.Pool() as pool:
+        for _ in pool.imap_unordered(_create_single_image_coco_json_task, tasks, chunksize=32):
+            pass
 
 def main():
     """Main function to process all image folders"""
@@ -5,8 +5,21 @@ Move original dataset files to data/origin directory and clean up.
 
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+def iter_json_files(root):
+    """Recursively yield paths of JSON files under root using os.scandir."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith('.json') and entry.is_file():
+                    yield entry.path
+
 def main():
     """Move original data to data/origin and clean up."""
     root_dir = Path(__file__).parent.parent
@@ -39,15 +52,18 @@ def main():
                 print(f"  Warning: {dst} already exists, skipping {item}")
             else:
                 print(f"  Moving {item}...")
-                shutil.move(str(src), str(dst))
+                try:
+                    os.rename(src, dst)
+                except OSError:
+                    # Fall back for moves across filesystems
+                    shutil.move(str(src), str(dst))
     
     # Delete original JSON files in original directories
     print("\nDeleting original JSON files...")
-    json_count = 0
-    for json_file in origin_dir.rglob('*.json'):
-        if json_file.is_file():
-            json_file.unlink()
-            json_count += 1
+    json_files = list(iter_json_files(origin_dir))
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(os.unlink, json_files))
+    json_count = len(json_files)
     
     print(f"  Deleted {json_count} JSON files")
     
@@ -4,13 +4,33 @@ Reorganize peachpear_flower_segmentation dataset to standard structure.
 
 This script reorganizes the dataset from the original structure to the standardized
 structure following the dataset structure specification.
+
+Images, JSON files and segmentation masks are hard-linked into the new structure when
+source and destination share a filesystem, so editing an output file in place also
+changes the original. Otherwise they are reflinked or copied.
 """
 
 import os
-import shutil
+import re
+import errno
+import heapq
 import json
+import multiprocessing
 from pathlib import Path
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Standardized category names
+CATEGORIES = ('apples', 'applebs', 'peaches', 'pears')
 
 # Mapping from original category names to standardized plural names
 CATEGORY_MAPPING = {
@@ -45,144 +65,263 @@ LABEL_FOLDERS = {
     'pears': ['PearLabels_2/PearLabels']
 }
 
+# Image file extensions (matched case-insensitively)
+IMAGE_EXTENSIONS = frozenset(['.jpg', '.bmp', '.png'])
+
+# Chunk size for kernel-side copies and buffer size for the userspace fallback
+COPY_CHUNK_SIZE = 1 << 30
+COPY_BUFFER_SIZE = 1 << 20
+
+# copy_file_range errors that mean the kernel path is unavailable for this pair of files
+COPY_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP}
+
+# Linux ioctl request for a copy-on-write clone of a whole file (FICLONE)
+FICLONE = 0x40049409
+
+
+def _fastcopy(src, dst):
+    """Copy file contents and modification time from src to dst."""
+    with open(src, 'rb', buffering=0) as fsrc, open(dst, 'wb', buffering=0) as fdst:
+        copied = False
+        if hasattr(os, 'copy_file_range'):
+            try:
+                copied_bytes = 0
+                while True:
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_CHUNK_SIZE)
+                    if not n:
+                        break
+                    copied_bytes += n
+                # Some filesystems report 0 without copying anything; fall back for those
+                copied = copied_bytes > 0 or os.fstat(fsrc.fileno()).st_size == 0
+            except OSError as e:
+                if e.errno not in COPY_FALLBACK_ERRNOS:
+                    raise
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+        
+        if not copied:
+            buffer = bytearray(COPY_BUFFER_SIZE)
+            view = memoryview(buffer)
+            while True:
+                n = fsrc.readinto(buffer)
+                if not n:
+                    break
+                fdst.write(view[:n])
+    
+    src_stat = os.stat(src)
+    os.utime(dst, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+
+
+def _needs_copy(src, dst):
+    """Check whether dst is missing or differs from src in size or modification time."""
+    try:
+        src_stat = os.stat(src)
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        return True
+    return (src_stat.st_size, src_stat.st_mtime_ns) != (dst_stat.st_size, dst_stat.st_mtime_ns)
+
+
+def _clone_or_copy(src, dst):
+    """Hard-link src to dst, falling back to a reflink clone, then to a copy."""
+    if not _needs_copy(src, dst):
+        return
+    
+    try:
+        os.link(src, dst)
+        return
+    except FileExistsError:
+        # Replace output from a previous run
+        os.unlink(dst)
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    except OSError:
+        pass
+    
+    if fcntl is not None:
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            src_stat = os.stat(src)
+            os.utime(dst, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+            return
+        except OSError:
+            pass
+    
+    _fastcopy(src, dst)
+
 
 def find_image_files(root_dir, category):
-    """Find all image files for a category."""
+    """Find all image files for a category, and the stems of JSON files beside them."""
     image_folder = Path(root_dir) / IMAGE_FOLDERS[category]
     if not image_folder.exists():
-        return []
+        return [], set()
     
     images = []
-    for ext in ['.JPG', '.jpg', '.BMP', '.bmp', '.PNG', '.png']:
-        images.extend(list(image_folder.glob(f'*{ext}')))
+    json_stems = set()
+    with os.scandir(image_folder) as entries:
+        for entry in entries:
+            stem, ext = os.path.splitext(entry.name)
+            if ext.lower() in IMAGE_EXTENSIONS:
+                if entry.is_file():
+                    images.append(Path(entry.path))
+            elif ext == '.json' and entry.is_file():
+                json_stems.add(stem)
     
-    return images
+    return images, json_stems
 
 
-def find_label_files(root_dir, category):
-    """Find all label/mask files for a category."""
-    label_folders = LABEL_FOLDERS[category]
-    labels = []
-    
-    for label_folder in label_folders:
-        label_path = Path(root_dir) / label_folder
-        if label_path.exists():
-            labels.extend(list(label_path.glob('*.png')))
-    
-    return labels
+def iter_label_files(root_dir, category):
+    """Yield (stem, path) for all label/mask files of a category."""
+    for label_folder in LABEL_FOLDERS[category]:
+        label_path = os.path.join(root_dir, label_folder)
+        if os.path.isdir(label_path):
+            with os.scandir(label_path) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.png') and entry.is_file():
+                        yield entry.name[:-len('.png')], entry.path
 
 
-def get_image_stem(image_path):
-    """Get image stem (filename without extension)."""
-    stem = image_path.stem
-    # Handle special cases like IMG_0248 -> 248
-    if stem.startswith('IMG_'):
-        stem = stem.replace('IMG_', '')
-    return stem
+def copy_image(image_path, images_dir):
+    """Copy image to destination images directory."""
+    dest_path = os.path.join(images_dir, image_path.name)
+    _clone_or_copy(image_path, dest_path)
+    return dest_path
 
 
-def get_label_stem(label_path):
-    """Get label stem (filename without extension)."""
-    return label_path.stem
+def copy_json(json_path, json_dir):
+    """Copy JSON annotation to destination JSON directory."""
+    dest_path = os.path.join(json_dir, json_path.name)
+    _clone_or_copy(json_path, dest_path)
+    return dest_path
 
 
-def copy_image(image_path, dest_dir, category):
-    """Copy image to destination directory."""
-    dest_path = dest_dir / 'images' / image_path.name
-    shutil.copy2(image_path, dest_path)
+def copy_segmentation(label_path, segmentations_dir, image_stem):
+    """Copy segmentation mask to destination segmentations directory."""
+    # Use image stem as filename
+    dest_path = os.path.join(segmentations_dir, f'{image_stem}.png')
+    _clone_or_copy(label_path, dest_path)
     return dest_path
 
 
-def copy_json(json_path, dest_dir, category):
-    """Copy JSON annotation to destination directory."""
-    dest_path = dest_dir / 'json' / json_path.name
-    shutil.copy2(json_path, dest_path)
-    return dest_path
+def load_json(json_path):
+    """Load a JSON file, using orjson when available."""
+    content = Path(json_path).read_bytes()
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
 
 
-def copy_segmentation(label_path, dest_dir, category, image_stem):
-    """Copy segmentation mask to destination directory."""
-    # Use image stem as filename
-    dest_path = dest_dir / 'segmentations' / f'{image_stem}.png'
-    shutil.copy2(label_path, dest_path)
-    return dest_path
+def save_json(data, json_path):
+    """Save data as indented JSON in a single write, using orjson when available."""
+    if orjson is not None:
+        content = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    else:
+        content = json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+    Path(json_path).write_bytes(content)
 
 
 def json_to_csv(json_path, csv_path):
     """Convert JSON annotation to CSV format."""
-    with open(json_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    data = load_json(json_path)
+    annotations = data.get('annotations') or ()
     
     csv_lines = ['#item,x,y,width,height,label']
+    for idx, ann in enumerate(annotations):
+        bbox = ann.get('bbox', [])
+        if len(bbox) == 4:
+            # Use label 1 for all annotations (each category folder has only one non-background category)
+            csv_lines.append(','.join(map(str, (idx, *bbox, 1))))
     
-    if 'annotations' in data and len(data['annotations']) > 0:
-        for idx, ann in enumerate(data['annotations']):
-            bbox = ann.get('bbox', [])
-            if len(bbox) == 4:
-                x, y, w, h = bbox
-                # Use label 1 for all annotations (each category folder has only one non-background category)
-                label = 1
-                csv_lines.append(f'{idx},{x},{y},{w},{h},{label}')
+    Path(csv_path).write_text('\n'.join(csv_lines) + '\n', encoding='utf-8')
+
+
+def _process_one(image_path, label_map, label_digits_map, json_stems, output_dirs):
+    """Copy one image with its JSON, CSV and segmentation mask; return the image stem."""
+    stem = image_path.stem
+    # Handle special cases like IMG_0248 -> 248
+    image_stem = stem[4:] if stem.startswith('IMG_') else stem
     
-    with open(csv_path, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(csv_lines) + '\n')
+    # Copy image
+    copy_image(image_path, output_dirs['images'])
+    
+    # Copy JSON if exists
+    if stem in json_stems:
+        json_path = image_path.parent / f'{stem}.json'
+        copy_json(json_path, output_dirs['json'])
+        
+        # Create CSV from JSON
+        csv_path = os.path.join(output_dirs['csv'], f'{stem}.csv')
+        json_to_csv(json_path, csv_path)
+    
+    # Copy segmentation mask if exists
+    # Try multiple possible label stems
+    label_found = False
+    for possible_stem in [image_stem, stem, str(int(image_stem)) if image_stem.isdigit() else None]:
+        if possible_stem and possible_stem in label_map:
+            copy_segmentation(label_map[possible_stem], output_dirs['segmentations'], stem)
+            label_found = True
+            break
+    
+    if not label_found:
+        # Try a label whose digits match the image's digits, if it is also a partial match
+        label_stem = label_digits_map.get(re.sub(r'\D', '', image_stem))
+        if label_stem and (image_stem in label_stem or label_stem in image_stem):
+            copy_segmentation(label_map[label_stem], output_dirs['segmentations'], stem)
+            label_found = True
+    
+    if not label_found:
+        # Try to find by partial match
+        for label_stem, label_path in label_map.items():
+            if image_stem in label_stem or label_stem in image_stem:
+                copy_segmentation(label_path, output_dirs['segmentations'], stem)
+                break
+    
+    return stem
 
 
 def reorganize_category(root_dir, category):
     """Reorganize a single category."""
-    print(f"\nProcessing category: {category}")
+    print(f"\nProcessing category: {category}", flush=True)
     root_path = Path(root_dir)
     dest_dir = root_path / category
     
+    # Create output directories once, so copies and pool workers can rely on them
+    output_dirs = {subdir: os.path.join(dest_dir, subdir)
+                   for subdir in ('images', 'json', 'segmentations', 'csv', 'sets')}
+    for output_dir in output_dirs.values():
+        os.makedirs(output_dir, exist_ok=True)
+    
     # Find all images
-    images = find_image_files(root_dir, category)
-    print(f"  Found {len(images)} images")
+    images, json_stems = find_image_files(root_dir, category)
+    print(f"  [{category}] Found {len(images)} images", flush=True)
     
-    # Find all labels
-    labels = find_label_files(root_dir, category)
-    print(f"  Found {len(labels)} segmentation masks")
+    # Find all labels, mapping label stem to label path
+    label_map = dict(iter_label_files(root_dir, category))
+    print(f"  [{category}] Found {len(label_map)} segmentation masks", flush=True)
     
-    # Create mapping from label stem to label path
-    label_map = {}
-    for label_path in labels:
-        label_stem = get_label_stem(label_path)
-        label_map[label_stem] = label_path
+    # Index label stems by their digits for partial-match lookups
+    label_digits_map = {}
+    for label_stem in label_map:
+        digits = re.sub(r'\D', '', label_stem)
+        if digits:
+            label_digits_map.setdefault(digits, label_stem)
     
-    # Process each image
+    # Process images in parallel (I/O bound)
     processed_images = []
-    for image_path in images:
-        image_stem = get_image_stem(image_path)
-        
-        # Copy image
-        dest_image = copy_image(image_path, dest_dir, category)
-        processed_images.append(dest_image.stem)
-        
-        # Copy JSON if exists
-        json_path = image_path.parent / f'{image_path.stem}.json'
-        if json_path.exists():
-            copy_json(json_path, dest_dir, category)
-            
-            # Create CSV from JSON
-            csv_path = dest_dir / 'csv' / f'{image_path.stem}.csv'
-            json_to_csv(json_path, csv_path)
-        
-        # Copy segmentation mask if exists
-        # Try multiple possible label stems
-        label_found = False
-        for possible_stem in [image_stem, image_path.stem, str(int(image_stem)) if image_stem.isdigit() else None]:
-            if possible_stem and possible_stem in label_map:
-                copy_segmentation(label_map[possible_stem], dest_dir, category, image_path.stem)
-                label_found = True
-                break
-        
-        if not label_found:
-            # Try to find by partial match
-            for label_stem, label_path in label_map.items():
-                if image_stem in label_stem or label_stem in image_stem:
-                    copy_segmentation(label_path, dest_dir, category, image_path.stem)
-                    break
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_process_one, image_path, label_map, label_digits_map,
+                                   json_stems, output_dirs)
+                   for image_path in images]
+        for future in as_completed(futures):
+            processed_images.append(future.result())
     
-    print(f"  Processed {len(processed_images)} images")
+    print(f"  [{category}] Processed {len(processed_images)} images", flush=True)
     return processed_images
 
 
@@ -204,10 +343,25 @@ def create_labelmap(category_dir, category_name):
     ]
     
     labelmap_path = Path(category_dir) / 'labelmap.json'
-    with open(labelmap_path, 'w', encoding='utf-8') as f:
-        json.dump(labelmap, f, indent=2, ensure_ascii=False)
+    save_json(labelmap, labelmap_path)
     
-    print(f"  Created labelmap.json")
+    print(f"  [{category_name}] Created labelmap.json", flush=True)
+
+
+def get_split_stems(split_images):
+    """Get the set of image stems named in a split file."""
+    stems = set(split_images)
+    for name in split_images:
+        stem, ext = os.path.splitext(name)
+        if ext.lower() in IMAGE_EXTENSIONS:
+            stems.add(stem)
+    return stems
+
+
+def write_split_file(split_path, image_stems):
+    """Write one image stem per line to a split file."""
+    with open(split_path, 'w', encoding='utf-8', buffering=1 << 16) as f:
+        f.writelines(f'{stem}\n' for stem in image_stems)
 
 
 def reorganize_splits(root_dir):
@@ -229,11 +383,15 @@ def reorganize_splits(root_dir):
         with open(val_file, 'r', encoding='utf-8') as f:
             val_images = {line.strip() for line in f if line.strip()}
     
+    # Split files may list names with or without an image extension
+    train_stems = get_split_stems(train_images)
+    val_stems = get_split_stems(val_images)
+    
     # Organize by category
-    category_splits = defaultdict(lambda: {'train': [], 'val': [], 'all': []})
+    category_splits = {}
     
     # Process each category
-    for category in ['apples', 'applebs', 'peaches', 'pears']:
+    for category in CATEGORIES:
         category_dir = root_path / category
         images_dir = category_dir / 'images'
         
@@ -242,58 +400,54 @@ def reorganize_splits(root_dir):
         
         # Get all images in this category
         all_category_images = []
-        for ext in ['.JPG', '.jpg', '.BMP', '.bmp', '.PNG', '.png']:
-            all_category_images.extend([img.stem for img in images_dir.glob(f'*{ext}')])
+        with os.scandir(images_dir) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext.lower() in IMAGE_EXTENSIONS and entry.is_file():
+                    all_category_images.append(stem)
         
         # Categorize into train/val
-        category_train = []
-        category_val = []
-        
-        for img_stem in all_category_images:
-            # Check if image is in train or val
-            img_name_with_ext = None
-            for ext in ['.JPG', '.jpg', '.BMP', '.bmp', '.PNG', '.png']:
-                if f'{img_stem}{ext}' in train_images or img_stem in train_images:
-                    category_train.append(img_stem)
-                    break
-                elif f'{img_stem}{ext}' in val_images or img_stem in val_images:
-                    category_val.append(img_stem)
-                    break
+        category_train = set()
+        category_val = set()
         
-        # If not found in splits, add remaining to train
         for img_stem in all_category_images:
-            if img_stem not in category_train and img_stem not in category_val:
-                category_train.append(img_stem)
+            # Check if image is in train or val; if not found in splits, add to train
+            if img_stem in train_stems:
+                category_train.add(img_stem)
+            elif img_stem in val_stems:
+                category_val.add(img_stem)
+            else:
+                category_train.add(img_stem)
         
-        category_splits[category]['train'] = sorted(category_train)
-        category_splits[category]['val'] = sorted(category_val)
-        category_splits[category]['all'] = sorted(all_category_images)
+        # Sort once and derive train/val by filtering the sorted list
+        all_sorted = sorted(all_category_images)
+        category_splits[category] = {
+            'train': [stem for stem in all_sorted if stem in category_train],
+            'val': [stem for stem in all_sorted if stem in category_val],
+            'all': all_sorted
+        }
     
     # Write split files for each category
     for category, splits in category_splits.items():
         sets_dir = root_path / category / 'sets'
         sets_dir.mkdir(parents=True, exist_ok=True)
         
-        # Write train.txt
-        with open(sets_dir / 'train.txt', 'w', encoding='utf-8') as f:
-            f.write('\n'.join(splits['train']) + '\n')
-        
-        # Write val.txt
-        with open(sets_dir / 'val.txt', 'w', encoding='utf-8') as f:
-            f.write('\n'.join(splits['val']) + '\n')
+        write_split_file(sets_dir / 'train.txt', splits['train'])
+        write_split_file(sets_dir / 'val.txt', splits['val'])
+        write_split_file(sets_dir / 'all.txt', splits['all'])
         
-        # Write all.txt
-        with open(sets_dir / 'all.txt', 'w', encoding='utf-8') as f:
-            f.write('\n'.join(splits['all']) + '\n')
-        
-        # Write train_val.txt
-        train_val = sorted(splits['train'] + splits['val'])
-        with open(sets_dir / 'train_val.txt', 'w', encoding='utf-8') as f:
-            f.write('\n'.join(train_val) + '\n')
+        # train and val are already sorted, so merge instead of re-sorting
+        write_split_file(sets_dir / 'train_val.txt', heapq.merge(splits['train'], splits['val']))
         
         print(f"  Created split files for {category}: {len(splits['train'])} train, {len(splits['val'])} val, {len(splits['all'])} total")
 
 
+def _process_category(root_dir, category):
+    """Reorganize a category and create its labelmap.json."""
+    reorganize_category(root_dir, category)
+    create_labelmap(Path(root_dir) / category, category)
+
+
 def main():
     """Main function."""
     root_dir = Path(__file__).parent.parent
@@ -301,10 +455,9 @@ def main():
     print("Reorganizing peachpear_flower_segmentation dataset...")
     print(f"Root directory: {root_dir}")
     
-    # Reorganize each category
-    for category in ['apples', 'applebs', 'peaches', 'pears']:
-        reorganize_category(root_dir, category)
-        create_labelmap(root_dir / category, category)
+    # Reorganize each category in its own process (categories are independent)
+    with multiprocessing.Pool(len(CATEGORIES)) as pool:
+        pool.starmap(_process_category, [(root_dir, category) for category in CATEGORIES])
     
     # Reorganize splits
     print("\nReorganizing dataset splits...")